@@ -9,6 +9,11 @@ worker_connections = 400
 timeout = 1200
 bind = "0.0.0.0:8080"
 
+# Warm-up of templates and statistics caches in every worker (see
+# statistics_oc.warm_up). The app is not preloaded in the master: with gevent
+# workers it would be imported before gevent monkey-patches the standard library
+warm_up_enabled = os.getenv("WARM_UP", "false").lower() == "true"
+
 # Logging
 accesslog = "-"
 errorlog = "-"
@@ -46,4 +51,11 @@ def post_worker_init(worker):
     """
     Called just after a worker has been initialized.
     """
+    if warm_up_enabled:
+        # Already loaded by the worker: this only fills the caches still empty
+        import statistics_oc
+        try:
+            statistics_oc.warm_up()
+        except Exception as e:
+            print(f"ERROR: Worker {worker.pid} warm-up failed: {e}")
     print(f"Worker {worker.pid} initialized and ready")
\ No newline at end of file
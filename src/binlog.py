@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Compact binary access log written by WebLogger as an alternative (or in
+addition) to the text one, a fast columnar reader, and a compaction tool that
+converts the existing oc-YYYY-MM.txt logs and merges the binary segments.
+
+A log is made of two files:
+    X.bin   header (magic, version, names of the logged variables) followed by
+            contiguous records of uint32: seconds, milliseconds, then one string
+            id per variable (0 means None)
+    X.str   the interned strings, each one as uint32 length + UTF-8 bytes, in
+            id order (ids start at 1)
+All the numbers are little-endian. Keeping the records fixed-size and apart
+from the strings lets the reader load every column with array.frombytes.
+
+WebLogger writes one segment per process (oc-YYYY-MM.<pid>-<time>-<n>.bin),
+since string ids are local to a log, and starts a new one when its string table
+exceeds MAX_STRINGS_SIZE bytes. Once a month is over, its segments can be
+merged into oc-YYYY-MM.bin, which is then read in place of them.
+
+Usage:
+    python3 -m src.binlog log/oc-2024-01.*.bin -o log/oc-2024-01.bin
+"""
+import glob
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+
+MAGIC = b"OCBL"
+VERSION = 2
+MAX_STRINGS_SIZE = 8 * 1024 * 1024
+
+_header_head = struct.Struct("<4sBH")
+_name_head = struct.Struct("<H")
+_string_head = struct.Struct("<I")
+
+
+def strings_path(file_path):
+    """Return the path of the string table of a binary log"""
+    return (file_path[:-len(".bin")] if file_path.endswith(".bin") else file_path) + ".str"
+
+
+def _header(list_of_web_var):
+    names = [name.encode("utf-8") for name in list_of_web_var]
+    return _header_head.pack(MAGIC, VERSION, len(names)) + \
+        b"".join(_name_head.pack(len(name)) + name for name in names)
+
+
+class BinaryLogWriter(object):
+    def __init__(self, file_path, list_of_web_var, max_strings_size=MAX_STRINGS_SIZE):
+        self.vars = list(list_of_web_var)
+        self.ids = {}
+        self.strings_size = 0
+        self.max_strings_size = max_strings_size
+        self.__record = struct.Struct("<" + "I" * (len(self.vars) + 2))
+        # Ids must be assigned in the order their strings reach the string table
+        self.lock = threading.Lock()
+        # Unbuffered: one write per request, as the text log handler does
+        self.f = open(file_path, "wb", buffering=0)
+        self.s = open(strings_path(file_path), "wb", buffering=0)
+        self.f.write(_header(self.vars))
+
+    @property
+    def full(self):
+        """True when the string table is over its size limit and a new log should be started"""
+        return self.max_strings_size is not None and self.strings_size >= self.max_strings_size
+
+    def __intern(self, value, new_strings):
+        if value is None:
+            return 0
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = len(self.ids) + 1
+            data = value.encode("utf-8", "surrogateescape")
+            new_strings.append(_string_head.pack(len(data)) + data)
+            self.strings_size += len(data)
+        return string_id
+
+    def write(self, values, timestamp=None):
+        seconds, millis = divmod(round((time.time() if timestamp is None else timestamp) * 1000), 1000)
+        with self.lock:
+            new_strings = []
+            ids = [self.__intern(value, new_strings) for value in values]
+            # Strings first, so that a record never refers to an unwritten string
+            if new_strings:
+                self.s.write(b"".join(new_strings))
+            self.f.write(self.__record.pack(seconds, millis, *ids))
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+            self.s.close()
+
+
+class BinaryLog(object):
+    """
+    Content of a binary log in columnar form: 'seconds' and 'millis' are the
+    arrays of the timestamps and 'columns' maps each variable to an array of
+    string ids, to be resolved through 'strings' (where the id 0 is None).
+    """
+    def __init__(self, list_of_web_var, strings, seconds, millis, columns):
+        self.vars = list_of_web_var
+        self.strings = strings
+        self.seconds = seconds
+        self.millis = millis
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def value_counts(self, var):
+        """Return a Counter of the values of a variable, counting ids before decoding them"""
+        strings = self.strings
+        return Counter({strings[string_id]: count
+                        for string_id, count in Counter(self.columns[var]).items()})
+
+    def records(self):
+        """Yield (timestamp, {variable: value}) for every logged request"""
+        strings = self.strings
+        columns = [self.columns[var] for var in self.vars]
+        for idx, (seconds, millis) in enumerate(zip(self.seconds, self.millis)):
+            yield seconds + millis / 1000, \
+                {var: strings[column[idx]] for var, column in zip(self.vars, columns)}
+
+
+def read_strings(file_path):
+    strings = [None]
+    if not os.path.exists(file_path):
+        return strings
+    with open(file_path, "rb") as f:
+        data = f.read()
+    offset, size = 0, len(data)
+    while offset + _string_head.size <= size:
+        (length,) = _string_head.unpack_from(data, offset)
+        offset += _string_head.size
+        if offset + length > size:
+            break  # truncated by a crash while writing
+        strings.append(data[offset:offset + length].decode("utf-8", "surrogateescape"))
+        offset += length
+    return strings
+
+
+def read_log(file_path):
+    with open(file_path, "rb") as f:
+        data = f.read()
+
+    if len(data) < _header_head.size:
+        raise ValueError(f"Not a binary access log: {file_path}")
+    magic, version, n_vars = _header_head.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a binary access log (version {VERSION}): {file_path}")
+    offset = _header_head.size
+    list_of_web_var = []
+    for _ in range(n_vars):
+        (length,) = _name_head.unpack_from(data, offset)
+        offset += _name_head.size
+        list_of_web_var.append(data[offset:offset + length].decode("utf-8"))
+        offset += length
+
+    # Whole records only, the last one may have been truncated by a crash
+    n_fields = n_vars + 2
+    record_size = 4 * n_fields
+    end = offset + (len(data) - offset) // record_size * record_size
+    fields = array("I")
+    fields.frombytes(memoryview(data)[offset:end])
+    if sys.byteorder == "big":
+        fields.byteswap()
+
+    # Each column is a strided slice of the records
+    columns = {var: fields[idx + 2::n_fields] for idx, var in enumerate(list_of_web_var)}
+
+    strings = read_strings(strings_path(file_path))
+    max_id = max((max(column, default=0) for column in columns.values()), default=0)
+    if max_id >= len(strings):
+        # String table truncated by a crash: unknown ids are read as None
+        strings.extend([None] * (max_id + 1 - len(strings)))
+
+    return BinaryLog(list_of_web_var, strings, fields[0::n_fields], fields[1::n_fields], columns)
+
+
+def month_segments(log_dir, month):
+    """
+    Return the binary logs of a month (YYYY-MM): the compacted one if it
+    exists, otherwise the segments written by the single processes.
+    """
+    compacted = os.path.join(log_dir, f"oc-{month}.bin")
+    if os.path.isfile(compacted):
+        return [compacted]
+    return sorted(glob.glob(os.path.join(log_dir, f"oc-{month}.*.bin")))
+
+
+@lru_cache(maxsize=4096)
+def _parse_second(asctime):
+    # Consecutive lines mostly share the same second
+    return datetime.strptime(asctime, "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+def parse_text_line(line, list_of_web_var):
+    """
+    Parse a line of a text access log ("%(asctime)s # VAR: value # VAR: value ")
+    looking only for the markers of the given variables, in order, so that a
+    "# NAME: " sent by a client inside a value cannot add columns. Return
+    (timestamp, {variable: value}), or None if the line does not match.
+    """
+    line = line.rstrip("\n")
+    if len(line) < 24 or line[23] != " ":
+        return None
+    try:
+        timestamp = _parse_second(line[:19]) + int(line[20:23]) / 1000
+    except ValueError:
+        return None
+
+    values = {}
+    pos = 24
+    last = len(list_of_web_var) - 1
+    for idx, var in enumerate(list_of_web_var):
+        marker = "# %s: " % var
+        if not line.startswith(marker, pos):
+            return None
+        start = pos + len(marker)
+        if idx < last:
+            end = line.find(" # %s: " % list_of_web_var[idx + 1], start)
+            if end == -1:
+                return None
+            pos = end + 1
+        else:
+            end = len(line) - 1 if line.endswith(" ") else len(line)
+        value = line[start:end]
+        values[var] = None if value == "None" else value
+    return timestamp, values
+
+
+def iter_text_log(file_path, list_of_web_var):
+    """Yield parse_text_line() for every line of a text access log"""
+    with open(file_path, "r", encoding="utf-8", errors="surrogateescape") as f:
+        for line in f:
+            yield parse_text_line(line, list_of_web_var)
+
+
+def compact(inputs, output, list_of_web_var=None):
+    """
+    Write in 'output' the records of all the input logs, either text (.txt)
+    or binary, in the given order, with the variables logged by the service
+    if not specified. The output is created even when there are no records.
+    Return the number of records written and of text lines skipped.
+
+    The text log and the binary segments of a month logged with
+    LOG_FORMAT=both contain the same requests: they must not be merged.
+    """
+    if list_of_web_var is None:
+        from src.wl import DEFAULT_WEB_VARS
+        list_of_web_var = DEFAULT_WEB_VARS
+    count = skipped = 0
+    writer = BinaryLogWriter(output, list_of_web_var, max_strings_size=None)
+    try:
+        for file_path in inputs:
+            if file_path.endswith(".txt"):
+                records = iter_text_log(file_path, writer.vars)
+            else:
+                records = read_log(file_path).records()
+            for record in records:
+                if record is None:
+                    skipped += 1
+                    continue
+                timestamp, values = record
+                writer.write([values.get(var) for var in writer.vars], timestamp)
+                count += 1
+    finally:
+        writer.close()
+    return count, skipped
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Convert text access logs and merge binary ones into a compact binary log')
+    parser.add_argument('inputs', nargs='+', help='text (.txt) or binary (.bin) access logs, in chronological order')
+    parser.add_argument('-o', '--output', help='output file (default: the single input with the .bin extension)')
+    parser.add_argument('--vars', nargs='+', help='logged variables, in order (default: those of the service)')
+    parser.add_argument('--keep-inputs', action='store_true',
+                        help='keep the merged binary segments (by default they are removed, '
+                             'since the compacted log replaces them)')
+
+    args = parser.parse_args()
+    output = args.output
+    if not output:
+        if len(args.inputs) != 1 or not args.inputs[0].endswith(".txt"):
+            parser.error("--output is required unless a single .txt log is given")
+        output = args.inputs[0][:-len(".txt")] + ".bin"
+    if not output.endswith(".bin"):
+        parser.error("the output must have the .bin extension")
+    if os.path.abspath(output) in (os.path.abspath(file_path) for file_path in args.inputs):
+        parser.error("the output cannot be one of the inputs")
+    segments = [file_path for file_path in args.inputs if not file_path.endswith(".txt")]
+    cur_month = datetime.now().strftime('%Y-%m')
+    if any(os.path.basename(file_path).startswith(f"oc-{cur_month}.") for file_path in segments):
+        parser.error(f"the segments of {cur_month} are still being written")
+
+    start = time.time()
+    try:
+        count, skipped = compact(args.inputs, output, args.vars)
+    except (ValueError, OSError) as e:
+        for file_path in (output, strings_path(output)):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not args.keep_inputs:
+        for file_path in segments:
+            os.remove(file_path)
+            if os.path.exists(strings_path(file_path)):
+                os.remove(strings_path(file_path))
+
+    out_size = os.path.getsize(output) + os.path.getsize(strings_path(output))
+    print(f"{count} records written to {output} in {time.time() - start:.1f}s "
+          f"({out_size} bytes, {skipped} unparsable text lines skipped)")
+    if count == 0:
+        print("Warning: no records found in the inputs", file=sys.stderr)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Bulk export of the monthly statistics in stats_dir as long-format rows
+(month, metric, labels, value), streamed as NDJSON, CSV or Parquet.
+
+Usage:
+    python3 -m src.export --format csv --from 2023-01 --to 2024-12 -o stats.csv
+"""
+import csv
+import importlib.util
+import io
+import json
+import os
+import re
+import sys
+
+FORMATS = ("ndjson", "csv", "parquet")
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet"
+}
+CHUNK_SIZE = 10000
+
+_file_regex = re.compile(r'oc-(\d{4})-(\d{2})\.prom')
+_month_regex = re.compile(r'(\d{4})-(\d{2})')
+
+
+def parse_month(value):
+    """Convert a YYYY-MM string into a (year, month) tuple, None if empty"""
+    if not value:
+        return None
+    match = _month_regex.fullmatch(value)
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        raise ValueError(f"Bad month format: {value} (use YYYY-MM)")
+    return int(match.group(1)), int(match.group(2))
+
+
+def list_months(stats_dir, month_from=None, month_to=None):
+    """Return the sorted (year, month, file path) of the statistics files in the range"""
+    months = []
+    for file in os.listdir(stats_dir):
+        match = _file_regex.fullmatch(file)
+        if match:
+            cur = int(match.group(1)), int(match.group(2))
+            if (month_from is None or cur >= month_from) and (month_to is None or cur <= month_to):
+                months.append((cur[0], cur[1], os.path.join(stats_dir, file)))
+    return sorted(months)
+
+
+def iter_rows(months):
+    """Lazily yield (month, metric, labels, value) for every sample of the months of list_months"""
+    from prometheus_client.parser import text_fd_to_metric_families
+    for year, month, file_path in months:
+        month_str = f"{year}-{str(month).zfill(2)}"
+        with open(file_path, 'r') as f:
+            for family in text_fd_to_metric_families(f):
+                for sample in family.samples:
+                    name, labels, value = sample[0], sample[1], sample[2]
+                    # Skip _created metrics (internal Prometheus timestamps)
+                    if name.endswith('_created'):
+                        continue
+                    yield month_str, name, labels, value
+
+
+def _format_value(value):
+    # Same rounding rule used for the Prometheus text output
+    if abs(value - round(value)) < 0.001:
+        return int(round(value))
+    return value
+
+
+def _chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_ndjson(rows, chunk_size=CHUNK_SIZE):
+    for chunk in _chunks(rows, chunk_size):
+        yield "".join(
+            json.dumps({"month": month, "metric": name, "labels": labels, "value": _format_value(value)}) + "\n"
+            for month, name, labels, value in chunk).encode("utf-8")
+
+
+def iter_csv(rows, chunk_size=CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["month", "metric", "labels", "value"])
+    for chunk in _chunks(rows, chunk_size):
+        for month, name, labels, value in chunk:
+            writer.writerow([month, name, json.dumps(labels, sort_keys=True), _format_value(value)])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, when there are no rows at all
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ChunkSink(object):
+    """Write-only file object handing the bytes written by pyarrow back to a generator"""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(rows, chunk_size=CHUNK_SIZE):
+    """Yield a Parquet file, one row group per chunk (requires pyarrow)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("month", pa.string()),
+        ("metric", pa.string()),
+        ("labels", pa.map_(pa.string(), pa.string())),
+        ("value", pa.float64())
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in _chunks(rows, chunk_size):
+        months, names, labels, values = zip(*chunk)
+        writer.write_table(pa.Table.from_arrays([
+            pa.array(months, pa.string()),
+            pa.array(names, pa.string()),
+            pa.array([list(cur.items()) for cur in labels], pa.map_(pa.string(), pa.string())),
+            pa.array(values, pa.float64())
+        ], schema=schema))
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+
+def export(stats_dir, fmt="ndjson", month_from=None, month_to=None, chunk_size=CHUNK_SIZE):
+    """
+    Return a generator of the encoded chunks of the export in the given format.
+    The months are listed here, so that a missing stats_dir raises before the
+    first chunk is requested.
+    """
+    writers = {"ndjson": iter_ndjson, "csv": iter_csv, "parquet": iter_parquet}
+    if fmt not in writers:
+        raise ValueError(f"Bad export format: {fmt} (use one of {', '.join(FORMATS)})")
+    if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise RuntimeError("Parquet export requires pyarrow to be installed")
+    months = list_months(stats_dir, month_from, month_to)
+    return writers[fmt](iter_rows(months), chunk_size)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    with open("conf.json") as f:
+        c = json.load(f)
+
+    parser = argparse.ArgumentParser(description='Export the OpenCitations monthly statistics')
+    parser.add_argument('--stats-dir', default=os.getenv("STATS_DIR", c["stats_dir"]),
+                        help='directory containing the oc-YYYY-MM.prom files')
+    parser.add_argument('--format', choices=FORMATS, default="ndjson", help='output format (default: ndjson)')
+    parser.add_argument('--from', dest='month_from', help='first month to export (YYYY-MM)')
+    parser.add_argument('--to', dest='month_to', help='last month to export (YYYY-MM)')
+    parser.add_argument('-o', '--output', help='output file (default: standard output)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help=f'rows per written chunk (default: {CHUNK_SIZE})')
+
+    args = parser.parse_args()
+    try:
+        chunks = export(args.stats_dir, args.format, parse_month(args.month_from),
+                        parse_month(args.month_to), args.chunk_size)
+        out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -15,15 +15,160 @@
 
 __author__ = 'essepuntato'
 import logging
+import re
 import web
 from datetime import datetime
-from os import sep, path, makedirs
+from ipaddress import ip_address, ip_network
+from os import sep, path, makedirs, getpid
+from threading import Lock
+from time import time
+from zlib import crc32
+from src.binlog import BinaryLogWriter
+
+
+# Request variables logged by the service
+DEFAULT_WEB_VARS = [
+    "HTTP_X_FORWARDED_FOR", # The IP address of the client
+    "REMOTE_ADDR",          # The IP address of internal balancer
+    "HTTP_USER_AGENT",      # The browser type of the visitor
+    "HTTP_REFERER",         # The URL of the page that called your program
+    "HTTP_HOST",            # The hostname of the page being attempted
+    "REQUEST_URI",          # The interpreted pathname of the requested document
+                            # or CGI (relative to the document root)
+    "HTTP_AUTHORIZATION",   # Access token
+]
+
+
+class RequestFilter(object):
+    """
+    Compiled form of the 'filter_request' dictionary of WebLogger. Each value
+    listed for a variable can be an exact string, a CIDR network (e.g.
+    "10.0.0.0/8" or "cidr:10.0.0.1", matched against every address of
+    comma-separated values such as HTTP_X_FORWARDED_FOR) or a regular
+    expression, given either as a compiled pattern or as a string prefixed by
+    "re:" (searched in the value). Strings with a "/" that are not networks,
+    such as user agents or URIs, are exact values.
+    """
+    def __init__(self, filter_request):
+        self.exact = {}
+        self.networks = {}
+        self.patterns = {}
+        for var, values in filter_request.items():
+            exact = set()
+            networks = {}
+            patterns = []
+            for value in values:
+                if isinstance(value, re.Pattern):
+                    patterns.append(value)
+                elif value.startswith("re:"):
+                    patterns.append(re.compile(value[3:]))
+                else:
+                    net = self.__network(value)
+                    if net is None:
+                        exact.add(value)
+                    else:
+                        # One set of network addresses per (version, prefix length):
+                        # a lookup masks the address once per distinct prefix
+                        networks.setdefault((net.version, net.prefixlen), set()).add(
+                            int(net.network_address))
+            if exact:
+                self.exact[var] = frozenset(exact)
+            if networks:
+                self.networks[var] = []
+                for (version, prefix), addrs in sorted(networks.items()):
+                    bits = 32 if version == 4 else 128
+                    mask = (2 ** bits - 1) ^ (2 ** (bits - prefix) - 1)
+                    self.networks[var].append((version, mask, frozenset(addrs)))
+            if patterns:
+                self.patterns[var] = tuple(patterns)
+        self.vars = tuple(set(self.exact) | set(self.networks) | set(self.patterns))
+
+    @staticmethod
+    def __network(value):
+        # "cidr:" must be a network, other values with a "/" are networks only
+        # if they parse as such (e.g. not "Mozilla/5.0" or "/favicon.ico")
+        if value.startswith("cidr:"):
+            return ip_network(value[5:].strip(), strict=False)
+        if "/" in value:
+            try:
+                return ip_network(value, strict=False)
+            except ValueError:
+                pass
+        return None
+
+    def __bool__(self):
+        return bool(self.vars)
+
+    def __in_networks(self, value, networks):
+        for addr in value.split(","):
+            try:
+                ip = ip_address(addr.strip())
+            except ValueError:
+                continue
+            ip_int = int(ip)
+            for version, mask, addrs in networks:
+                if ip.version == version and ip_int & mask in addrs:
+                    return True
+        return False
+
+    def match(self, env):
+        for var in self.vars:
+            value = str(env.get(var))
+            if value in self.exact.get(var, ()):
+                return True
+            networks = self.networks.get(var)
+            if networks and self.__in_networks(value, networks):
+                return True
+            for pattern in self.patterns.get(var, ()):
+                if pattern.search(value):
+                    return True
+        return False
+
+
+class RequestSampler(object):
+    """
+    Compiled form of the 'sample_request' dictionary of WebLogger, which maps
+    REQUEST_URI prefixes (e.g. "/static/") to the fraction of the matching
+    requests to log. The decision is a hash of the logged values, so it is the
+    same in every worker and for every repetition of the same request.
+    """
+    def __init__(self, sample_request):
+        # Longest prefixes first, so that the most specific rate wins
+        self.rates = sorted(
+            ((prefix, int(min(max(rate, 0.0), 1.0) * 0xFFFFFFFF))
+             for prefix, rate in sample_request.items()),
+            key=lambda item: len(item[0]), reverse=True)
+
+    def __bool__(self):
+        return bool(self.rates)
+
+    def keep(self, env, list_of_web_var):
+        uri = env.get("REQUEST_URI") or ""
+        for prefix, threshold in self.rates:
+            if uri.startswith(prefix):
+                key = "\x1f".join(str(env.get(var)) for var in list_of_web_var)
+                return crc32(key.encode("utf-8")) <= threshold
+        return True
+
 
 class WebLogger(object):
-    def __init__(self, name, log_dir, list_of_web_var=[], filter_request={}):
+    # 'log_format' is "text" (oc-YYYY-MM.txt), "binary" (see src/binlog.py) or "both"
+    def __init__(self, name, log_dir, list_of_web_var=[], filter_request={}, sample_request={},
+                 log_format="text"):
+        if log_format not in ("text", "binary", "both"):
+            raise ValueError("Bad log format: %s (use text, binary or both)" % log_format)
         self.l = logging.getLogger(name)
         self.vars = list_of_web_var
-        self.filter = filter_request
+        self.filter = RequestFilter(filter_request)
+        self.sampler = RequestSampler(sample_request)
+        self.text = log_format in ("text", "both")
+        self.binary = log_format in ("binary", "both")
+        self.binary_writer = None
+        self.binary_pid = None
+        self.binary_month = None
+        self.binary_segment = 0
+        # Rotation and writes of the binary segment, as logging does for its handlers
+        self.binary_lock = Lock()
 
         # Configure logger
         self.l.setLevel(logging.INFO)
@@ -42,11 +187,14 @@ class WebLogger(object):
                     self.l.removeHandler(fh)
 
             self.month = cur_month
+            if not path.exists(self.log_dir):
+                makedirs(self.log_dir)
+
+            if not self.text:
+                return
+
             file_path = self.log_dir + sep + "oc-" + self.month + ".txt"
             if not path.exists(file_path):
-                file_dir = path.dirname(file_path)
-                if not path.exists(file_dir):
-                    makedirs(file_dir)
                 open(file_path, "a").close()
 
             file_handler = logging.FileHandler(file_path)
@@ -55,16 +203,40 @@ class WebLogger(object):
             file_handler.setLevel(logging.INFO)
             self.l.addHandler(file_handler)
 
+    def __set_binary_writer(self):
+        # Called holding binary_lock. One segment per process (string ids are
+        # local to a file), opened lazily so that forked processes get their
+        # own, and a new one every month or when the strings interned in
+        # memory reach their limit
+        if self.binary_writer is None or self.binary_pid != getpid() or \
+                self.binary_month != self.month or self.binary_writer.full:
+            if self.binary_writer is not None and self.binary_pid == getpid():
+                self.binary_writer.close()
+            self.binary_pid = getpid()
+            self.binary_month = self.month
+            self.binary_segment += 1
+            self.binary_writer = BinaryLogWriter(
+                self.log_dir + sep + "oc-%s.%s-%s-%s.bin" % (
+                    self.month, self.binary_pid, int(time()), self.binary_segment), self.vars)
+
     def mes(self):
-        cur_message = ""
-        must_be_filtered = False
-        for var in self.vars:
-            cur_value = str(web.ctx.env.get(var))
-            if var in self.filter and cur_value in self.filter[var]:
-                must_be_filtered = True
-            cur_message += "# %s: %s " % (var, cur_value)
-        if not must_be_filtered:
-            # Use the correct file handler
-            self.__set_file_handler()
+        env = web.ctx.env
+        # Decide before building the message, so dropped requests cost nothing
+        if self.filter and self.filter.match(env):
+            return
+        if self.sampler and not self.sampler.keep(env, self.vars):
+            return
+
+        # Use the correct file handler
+        self.__set_file_handler()
+        if self.binary:
+            values = [env.get(var) for var in self.vars]
+            with self.binary_lock:
+                self.__set_binary_writer()
+                self.binary_writer.write(values)
+        if self.text:
+            cur_message = ""
+            for var in self.vars:
+                cur_message += "# %s: %s " % (var, str(env.get(var)))
             self.l.info(cur_message)
 
@@ -1,15 +1,14 @@
 import web
 import os
 import json
-from src.wl import WebLogger
-import requests
-import subprocess
+from src.wl import WebLogger, DEFAULT_WEB_VARS
 from os import path
 import sys
-import argparse
 import re
-from prometheus_client import Counter, CollectorRegistry, generate_latest, Gauge, Info
-from prometheus_client.parser import text_fd_to_metric_families
+from functools import lru_cache
+from itertools import chain
+# subprocess, argparse, prometheus_client and src.export are imported where
+# they are used, so that spawning a worker does not pay for them
 
 # Load the configuration file
 with open("conf.json") as f:
@@ -21,7 +20,13 @@ env_config = {
     "base_url": os.getenv("BASE_URL", c["base_url"]),
     "log_dir": os.getenv("LOG_DIR", c["log_dir"]),
     "stats_dir": os.getenv("STATS_DIR", c["stats_dir"]),
-    "sync_enabled": os.getenv("SYNC_ENABLED", "false").lower() == "true"
+    "sync_enabled": os.getenv("SYNC_ENABLED", "false").lower() == "true",
+    # Access log format: "text", "binary" or "both" (see src/binlog.py)
+    "log_format": os.getenv("LOG_FORMAT", "text").lower(),
+    # Number of recent months parsed by warm_up() (0 disables the warm-up)
+    "warm_up_months": int(os.getenv("WARM_UP_MONTHS", "0")),
+    # Parsed months kept in memory by every worker (at least warm_up_months)
+    "stats_cache_months": int(os.getenv("STATS_CACHE_MONTHS", os.getenv("WARM_UP_MONTHS", "0")))
 }
 
 active = {
@@ -46,22 +51,16 @@ urls = (
     "/static/(.*)", "Static",
     '/favicon.ico', 'Favicon',
     # Statistics
-    "/statistics/(.+)", "Statistics"
+    "/statistics/(.+)", "Statistics",
+    # Bulk export of the whole history, or of a range of months
+    "/export/?(.*)", "Export"
 )
 
 # Set the web logger
-web_logger = WebLogger(env_config["base_url"], env_config["log_dir"], [
-    "HTTP_X_FORWARDED_FOR", # The IP address of the client
-    "REMOTE_ADDR",          # The IP address of internal balancer
-    "HTTP_USER_AGENT",      # The browser type of the visitor
-    "HTTP_REFERER",         # The URL of the page that called your program
-    "HTTP_HOST",            # The hostname of the page being attempted
-    "REQUEST_URI",          # The interpreted pathname of the requested document
-                            # or CGI (relative to the document root)
-    "HTTP_AUTHORIZATION",   # Access token
-    ],
+web_logger = WebLogger(env_config["base_url"], env_config["log_dir"], DEFAULT_WEB_VARS,
     # comment this line only for test purposes
-     {"REMOTE_ADDR": ["130.136.130.1", "130.136.2.47", "127.0.0.1"]}
+     {"REMOTE_ADDR": ["130.136.130.1", "130.136.2.47", "127.0.0.1"]},
+    log_format=env_config["log_format"]
 )
 
 render = web.template.render(c["html"], globals={
@@ -80,6 +79,7 @@ def sync_static_files():
     """
     Function to synchronize static files using sync_static.py
     """
+    import subprocess
     try:
         print("Starting static files synchronization...")
         subprocess.run([sys.executable, "sync_static.py", "--auto"], check=True)
@@ -116,6 +116,55 @@ def clean_prometheus_output(content):
     return '\n'.join(filtered)
 
 
+# Month catalogue, refreshed only when the content of stats_dir changes
+_catalogue = {"mtime": None, "months": []}
+
+
+def month_catalogue():
+    """Return the sorted (year, month, file path) of all the monthly statistics files"""
+    mtime = os.stat(env_config["stats_dir"]).st_mtime
+    if _catalogue["mtime"] != mtime:
+        from src import export
+        _catalogue["months"] = export.list_months(env_config["stats_dir"])
+        _catalogue["mtime"] = mtime
+    return _catalogue["months"]
+
+
+@lru_cache(maxsize=max(env_config["stats_cache_months"], env_config["warm_up_months"]))
+def _parse_month(file_path, mtime):
+    from prometheus_client.parser import text_fd_to_metric_families
+    samples = []
+    with open(file_path, 'r') as f:
+        for family in text_fd_to_metric_families(f):
+            for sample in family.samples:
+                samples.append((sample[0], sample[1], sample[2]))
+    return samples
+
+
+def load_month_samples(file_path):
+    """Return the (name, labels, value) samples of a monthly file, parsed once per modification"""
+    return _parse_month(file_path, os.path.getmtime(file_path))
+
+
+def warm_up(months=None):
+    """
+    Compile the templates, prime the month catalogue and parse the most recent
+    months, so that the first request served by a worker finds warm caches.
+    """
+    months = env_config["warm_up_months"] if months is None else months
+    render.statistics
+    render.common.header
+    render.common.footer
+    # Imported lazily by the request handlers
+    import prometheus_client
+    import prometheus_client.parser
+    if os.path.isdir(env_config["stats_dir"]):
+        catalogue = month_catalogue()
+        if months > 0:
+            for _, _, file_path in catalogue[-months:]:
+                load_month_samples(file_path)
+
+
 class Favicon:
     def GET(self):
         is_https = web.ctx.env.get('HTTP_X_FORWARDED_PROTO') == 'https' or web.ctx.env.get('HTTPS') == 'on' or web.ctx.env.get('SERVER_PORT') == '443'
@@ -192,6 +241,8 @@ class Statistics:
                 if year_from > year_to or (year_from == year_to and month_from > month_to):
                     raise web.HTTPError("400 ", {"Content-Type": "text/plain"}, "Bad date: ending before beginning")
 
+                from prometheus_client import Counter, CollectorRegistry, generate_latest, Gauge, Info
+
                 registry = CollectorRegistry()
 
                 # Create all metrics
@@ -216,6 +267,25 @@ class Statistics:
                 date_info = Info('opencitations_date', 'Date info', registry=registry)
                 date_info.info({'month_from': month_from, 'year_from': year_from, 'month_to': month_to, 'year_to': year_to})
 
+                # Map metric names to counters (True if the labels must be kept)
+                mapping = {
+                    'opencitations_api_requests_total': ('api_requests', False),
+                    'opencitations_api_index_requests_total': ('api_index_requests', False),
+                    'opencitations_api_index_requests_by_version_total': ('api_index_by_version', True),
+                    'opencitations_api_meta_requests_total': ('api_meta_requests', False),
+                    'opencitations_sparql_requests_total': ('sparql_requests', False),
+                    'opencitations_search_requests_total': ('search_requests', False),
+                    'opencitations_requests_total': ('total_requests', False),
+                    'opencitations_api_requests_by_token_total': ('api_by_token', True),
+                    'opencitations_requests_by_response_class_total': ('by_response_class', True),
+                    'opencitations_requests_by_method_total': ('by_method', True),
+                    'opencitations_requests_by_status_total': ('by_status', True),
+                    'opencitations_requests_by_country_total': ('by_country', True),
+                    'opencitations_requests_by_continent_total': ('by_continent', True),
+                    'opencitations_indexed_records': ('indexed_records', False),
+                    'opencitations_harvested_data_sources': ('harvested_sources', False)
+                }
+
                 # Aggregate monthly files
                 current_month, current_year = int(month_from), int(year_from)
                 target_month, target_year = int(month_to), int(year_to)
@@ -226,40 +296,17 @@ class Statistics:
                         file_path = path.join(env_config["stats_dir"], f"oc-{current_year}-{month_str}.prom")
                         
                         if path.isfile(file_path):
-                            with open(file_path, 'r') as f:
-                                for family in text_fd_to_metric_families(f):
-                                    for sample in family.samples:
-                                        name, labels, value = sample[0], sample[1], sample[2]
-                                        
-                                        # Map metric names to counters
-                                        mapping = {
-                                            'opencitations_api_requests_total': ('api_requests', None),
-                                            'opencitations_api_index_requests_total': ('api_index_requests', None),
-                                            'opencitations_api_index_requests_by_version_total': ('api_index_by_version', labels),
-                                            'opencitations_api_meta_requests_total': ('api_meta_requests', None),
-                                            'opencitations_sparql_requests_total': ('sparql_requests', None),
-                                            'opencitations_search_requests_total': ('search_requests', None),
-                                            'opencitations_requests_total': ('total_requests', None),
-                                            'opencitations_api_requests_by_token_total': ('api_by_token', labels),
-                                            'opencitations_requests_by_response_class_total': ('by_response_class', labels),
-                                            'opencitations_requests_by_method_total': ('by_method', labels),
-                                            'opencitations_requests_by_status_total': ('by_status', labels),
-                                            'opencitations_requests_by_country_total': ('by_country', labels),
-                                            'opencitations_requests_by_continent_total': ('by_continent', labels),
-                                            'opencitations_indexed_records': ('indexed_records', None),
-                                            'opencitations_harvested_data_sources': ('harvested_sources', None)
-                                        }
-                                        
-                                        if name in mapping:
-                                            metric_key, metric_labels = mapping[name]
-                                            metric = metrics[metric_key]
-                                            
-                                            if metric_labels:
-                                                metric.labels(**metric_labels).inc(value)
-                                            elif isinstance(metric, Gauge):
-                                                metric.set(value)
-                                            else:
-                                                metric.inc(value)
+                            for name, labels, value in load_month_samples(file_path):
+                                if name in mapping:
+                                    metric_key, with_labels = mapping[name]
+                                    metric = metrics[metric_key]
+
+                                    if with_labels and labels:
+                                        metric.labels(**labels).inc(value)
+                                    elif isinstance(metric, Gauge):
+                                        metric.set(value)
+                                    else:
+                                        metric.inc(value)
 
                         if (current_year == target_year and current_month >= target_month) or current_month == 12:
                             break
@@ -280,13 +327,9 @@ class Statistics:
                 else:
                     raise web.HTTPError("400 ", {"Content-Type": "text/plain"}, "Bad date format: use YYYY-MM or YYYY-MM_YYYY-MM")
         else:
-            max_year = max_month = 0
-            for file in os.listdir(env_config["stats_dir"]):
-                if self.__file_regex.match(file):
-                    year, month = map(int, self.__file_regex.search(file).groups())
-                    if year > max_year or (year == max_year and month > max_month):
-                        max_year, max_month = year, month
-                        file_path = path.join(env_config["stats_dir"], file)
+            months = month_catalogue()
+            if months:
+                file_path = months[-1][2]
 
         if file_path:
             web.header('Content-Type', "text/plain")
@@ -296,6 +339,46 @@ class Statistics:
             raise web.HTTPError("404 ", {"Content-Type": "text/plain"}, "No statistics found")
 
 
+class Export:
+    def GET(self, dates):
+        from src import export
+        web_logger.mes()
+        org_ref = web.ctx.env.get('HTTP_REFERER')
+        if org_ref and org_ref.endswith("/"):
+            org_ref = org_ref[:-1]
+        web.header('Access-Control-Allow-Origin', org_ref or "*")
+        web.header('Access-Control-Allow-Credentials', 'true')
+        web.header('Access-Control-Allow-Methods', '*')
+        web.header('Access-Control-Allow-Headers', 'Authorization')
+
+        fmt = web.input(format="ndjson").format.lower()
+        try:
+            month_from, _, month_to = dates.partition("_")
+            month_from = export.parse_month(month_from)
+            month_to = export.parse_month(month_to) if month_to else month_from
+            if month_from and month_to and month_from > month_to:
+                raise ValueError("Bad date: ending before beginning")
+            chunks = export.export(env_config["stats_dir"], fmt, month_from, month_to)
+        except ValueError as e:
+            raise web.HTTPError("400 ", {"Content-Type": "text/plain"}, str(e))
+        except RuntimeError as e:
+            raise web.HTTPError("501 ", {"Content-Type": "text/plain"}, str(e))
+        except OSError:
+            raise web.HTTPError("500 ", {"Content-Type": "text/plain"}, "Statistics not available")
+
+        # Produce the first chunk before the headers are sent, so that a
+        # malformed first month gets an error status instead of a truncated body
+        try:
+            first_chunk = next(chunks, b"")
+        except Exception:
+            raise web.HTTPError("500 ", {"Content-Type": "text/plain"}, "Statistics not available")
+
+        web.header('Content-Type', export.CONTENT_TYPES[fmt])
+        web.header('Content-Disposition', f'attachment; filename="oc-statistics{"-" + dates if dates else ""}.{fmt}"')
+        # Streamed chunk by chunk by web.py
+        return chain([first_chunk], chunks)
+
+
 # Run the application
 if __name__ == "__main__":
     # Add startup log
@@ -304,6 +387,7 @@ if __name__ == "__main__":
     print(f"Sync enabled: {env_config['sync_enabled']}")
     
     # Parse command line arguments
+    import argparse
     parser = argparse.ArgumentParser(description='STATISTICS OpenCitations web application')
     parser.add_argument(
         '--sync-static',
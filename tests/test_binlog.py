@@ -0,0 +1,161 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from src import binlog
+
+VARS = ["REMOTE_ADDR", "HTTP_USER_AGENT", "REQUEST_URI"]
+
+
+class BinaryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write_log(self, file_path, records, **kwargs):
+        writer = binlog.BinaryLogWriter(file_path, VARS, **kwargs)
+        for timestamp, values in records:
+            writer.write(values, timestamp)
+        writer.close()
+        return writer
+
+    def test_round_trip(self):
+        records = [
+            (1704103200.005, ["1.2.3.4", "Mozilla/5.0", "/statistics/last-month"]),
+            (1704103201.999, ["1.2.3.4", None, "/statistics/2024-01"]),
+            (1704103202.0, ["5.6.7.8", "Mozilla/5.0", "/statistics/last-month"])
+        ]
+        self.write_log(self.path("a.bin"), records)
+        log = binlog.read_log(self.path("a.bin"))
+
+        self.assertEqual(log.vars, VARS)
+        self.assertEqual(len(log), 3)
+        read = list(log.records())
+        for (timestamp, values), (read_timestamp, read_values) in zip(records, read):
+            self.assertAlmostEqual(timestamp, read_timestamp, places=3)
+            self.assertEqual(dict(zip(VARS, values)), read_values)
+        self.assertEqual(log.value_counts("HTTP_USER_AGENT"), {"Mozilla/5.0": 2, None: 1})
+        # Interned once each: 2 addresses, 1 user agent, 2 URIs
+        self.assertEqual(len(log.strings), 1 + 5)
+
+    def test_threads(self):
+        writer = binlog.BinaryLogWriter(self.path("a.bin"), VARS)
+
+        def write(thread):
+            for idx in range(20000):
+                value = "%s-%s" % (thread, idx)
+                writer.write([value, "ua-" + value, "/" + value], 1.0)
+
+        # Switch threads as often as possible, to interleave the interning
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=write, args=(thread,)) for thread in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        writer.close()
+
+        log = binlog.read_log(self.path("a.bin"))
+        self.assertEqual(len(log), 8 * 20000)
+        for _, values in log.records():
+            addr = values["REMOTE_ADDR"]
+            self.assertEqual((values["HTTP_USER_AGENT"], values["REQUEST_URI"]), ("ua-" + addr, "/" + addr))
+
+    def test_truncated_record(self):
+        self.write_log(self.path("a.bin"), [(1.0, ["a", "b", "c"]), (2.0, ["a", "b", "d"])])
+        with open(self.path("a.bin"), "ab") as f:
+            f.write(b"\x01\x02\x03")
+        self.assertEqual(len(binlog.read_log(self.path("a.bin"))), 2)
+
+    def test_not_a_log(self):
+        with open(self.path("a.bin"), "wb") as f:
+            f.write(b"2024-01-01 10:00:00,005 # REMOTE_ADDR: x")
+        with self.assertRaises(ValueError):
+            binlog.read_log(self.path("a.bin"))
+
+    def test_full(self):
+        writer = self.write_log(self.path("a.bin"), [(1.0, ["a" * 10, "b", "c"])], max_strings_size=12)
+        self.assertTrue(writer.full)
+        writer = self.write_log(self.path("b.bin"), [(1.0, ["a" * 10, "b", "c"])], max_strings_size=None)
+        self.assertFalse(writer.full)
+
+    def test_month_segments(self):
+        for name in ("oc-2024-01.1-1-1.bin", "oc-2024-01.2-1-1.bin", "oc-2024-02.1-1-1.bin"):
+            self.write_log(self.path(name), [])
+        self.assertEqual([os.path.basename(p) for p in binlog.month_segments(self.dir, "2024-01")],
+                         ["oc-2024-01.1-1-1.bin", "oc-2024-01.2-1-1.bin"])
+        self.write_log(self.path("oc-2024-01.bin"), [])
+        self.assertEqual(binlog.month_segments(self.dir, "2024-01"), [self.path("oc-2024-01.bin")])
+
+
+class TextLogTest(unittest.TestCase):
+    def test_parse_line(self):
+        timestamp, values = binlog.parse_text_line(
+            "2024-01-01 10:00:00,005 # REMOTE_ADDR: 1.2.3.4 # HTTP_USER_AGENT: Mozilla/5.0 (X) "
+            "# REQUEST_URI: /statistics/last-month \n", VARS)
+        self.assertEqual(values, {"REMOTE_ADDR": "1.2.3.4", "HTTP_USER_AGENT": "Mozilla/5.0 (X)",
+                                  "REQUEST_URI": "/statistics/last-month"})
+        self.assertAlmostEqual(timestamp % 1, 0.005, places=3)
+
+    def test_none(self):
+        _, values = binlog.parse_text_line(
+            "2024-01-01 10:00:00,005 # REMOTE_ADDR: None # HTTP_USER_AGENT: None # REQUEST_URI: / ", VARS)
+        self.assertEqual(values, {"REMOTE_ADDR": None, "HTTP_USER_AGENT": None, "REQUEST_URI": "/"})
+
+    def test_injected_marker(self):
+        _, values = binlog.parse_text_line(
+            "2024-01-01 10:00:00,005 # REMOTE_ADDR: 1.2.3.4 # HTTP_USER_AGENT: Mozilla/5.0 # X: y "
+            "# REQUEST_URI: / ", VARS)
+        self.assertEqual(set(values), set(VARS))
+        self.assertEqual(values["HTTP_USER_AGENT"], "Mozilla/5.0 # X: y")
+
+    def test_unparsable(self):
+        self.assertIsNone(binlog.parse_text_line("garbage\n", VARS))
+        self.assertIsNone(binlog.parse_text_line("2024-01-01 10:00:00,005 # REMOTE_ADDR: x ", VARS))
+
+
+class CompactTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_text_and_segments(self):
+        text = os.path.join(self.dir, "oc-2024-01.txt")
+        with open(text, "w") as f:
+            f.write("2024-01-01 10:00:00,005 # REMOTE_ADDR: 1.2.3.4 # HTTP_USER_AGENT: ua # REQUEST_URI: /a \n")
+            f.write("not a log line\n")
+        segment = os.path.join(self.dir, "oc-2024-01.1-1-1.bin")
+        writer = binlog.BinaryLogWriter(segment, VARS)
+        writer.write(["5.6.7.8", "ua", "/b"], 1704200000.5)
+        writer.close()
+
+        output = os.path.join(self.dir, "oc-2024-01.bin")
+        self.assertEqual(binlog.compact([text, segment], output, VARS), (2, 1))
+        log = binlog.read_log(output)
+        self.assertEqual([values["REQUEST_URI"] for _, values in log.records()], ["/a", "/b"])
+        self.assertEqual(log.value_counts("HTTP_USER_AGENT"), {"ua": 2})
+
+    def test_no_records(self):
+        output = os.path.join(self.dir, "out.bin")
+        self.assertEqual(binlog.compact([], output, VARS), (0, 0))
+        log = binlog.read_log(output)
+        self.assertEqual((log.vars, len(log)), (VARS, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
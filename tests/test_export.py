@@ -0,0 +1,84 @@
+import csv
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from src import export
+
+PROM = """# HELP opencitations_requests_total Total HTTP requests
+# TYPE opencitations_requests_total counter
+opencitations_requests_total 1.5e+06
+opencitations_requests_created 1.7e+09
+# HELP opencitations_requests_by_country_total By country
+# TYPE opencitations_requests_by_country_total counter
+opencitations_requests_by_country_total{country="Italy",country_iso="IT"} 12.0
+"""
+
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stats_dir = self.tmp.name
+        for month in ("2023-12", "2024-01", "2024-02"):
+            with open(os.path.join(self.stats_dir, f"oc-{month}.prom"), "w") as f:
+                f.write(PROM)
+        open(os.path.join(self.stats_dir, "oc-2024-03.prom.bak"), "w").close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parse_month(self):
+        self.assertEqual(export.parse_month("2024-01"), (2024, 1))
+        self.assertIsNone(export.parse_month(""))
+        for bad in ("2024-1", "2024-13", "2024-01\n", "x2024-01", "2024-01-01"):
+            with self.assertRaises(ValueError):
+                export.parse_month(bad)
+
+    def test_list_months(self):
+        months = export.list_months(self.stats_dir, (2024, 1), None)
+        self.assertEqual([(year, month) for year, month, _ in months], [(2024, 1), (2024, 2)])
+
+    def test_ndjson(self):
+        data = b"".join(export.export(self.stats_dir, "ndjson", (2024, 1), (2024, 1), chunk_size=1))
+        rows = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+        self.assertEqual(rows, [
+            {"month": "2024-01", "metric": "opencitations_requests_total", "labels": {}, "value": 1500000},
+            {"month": "2024-01", "metric": "opencitations_requests_by_country_total",
+             "labels": {"country": "Italy", "country_iso": "IT"}, "value": 12}
+        ])
+
+    def test_csv(self):
+        data = b"".join(export.export(self.stats_dir, "csv"))
+        rows = list(csv.reader(io.StringIO(data.decode("utf-8"))))
+        self.assertEqual(rows[0], ["month", "metric", "labels", "value"])
+        self.assertEqual(len(rows), 1 + 3 * 2)
+        self.assertEqual([row[0] for row in rows[1::2]], ["2023-12", "2024-01", "2024-02"])
+
+    def test_csv_without_rows(self):
+        data = b"".join(export.export(self.stats_dir, "csv", (2025, 1)))
+        self.assertEqual(data.decode("utf-8").splitlines(), ["month,metric,labels,value"])
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+        data = b"".join(export.export(self.stats_dir, "parquet", (2024, 1), chunk_size=1))
+        rows = pq.read_table(io.BytesIO(data)).to_pylist()
+        self.assertEqual(len(rows), 2 * 2)
+        self.assertEqual(rows[0], {"month": "2024-01", "metric": "opencitations_requests_total",
+                                   "labels": [], "value": 1500000.0})
+        self.assertEqual(rows[1]["metric"], "opencitations_requests_by_country_total")
+        self.assertEqual(dict(rows[1]["labels"]), {"country": "Italy", "country_iso": "IT"})
+        self.assertEqual([row["month"] for row in rows], ["2024-01", "2024-01", "2024-02", "2024-02"])
+
+    def test_errors_before_streaming(self):
+        with self.assertRaises(ValueError):
+            export.export(self.stats_dir, "xml")
+        with self.assertRaises(OSError):
+            export.export(os.path.join(self.stats_dir, "missing"), "ndjson")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# statistics_oc reads its configuration when imported
+_log_dir = tempfile.TemporaryDirectory()
+os.environ.setdefault("LOG_DIR", _log_dir.name)
+os.environ.setdefault("STATS_CACHE_MONTHS", "4")
+
+import statistics_oc
+
+JANUARY = """# TYPE opencitations_requests_total counter
+opencitations_requests_total 10.0
+# TYPE opencitations_requests_by_country_total counter
+opencitations_requests_by_country_total{country="Italy",country_iso="IT"} 4.0
+opencitations_requests_by_country_total{country="France",country_iso="FR"} 6.0
+# TYPE opencitations_indexed_records gauge
+opencitations_indexed_records 100.0
+"""
+
+FEBRUARY = """# TYPE opencitations_requests_total counter
+opencitations_requests_total 5.0
+# TYPE opencitations_requests_by_country_total counter
+opencitations_requests_by_country_total{country="Italy",country_iso="IT"} 5.0
+# TYPE opencitations_indexed_records gauge
+opencitations_indexed_records 150.0
+"""
+
+
+class StatisticsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stats_dir = self.tmp.name
+        self.old_stats_dir = statistics_oc.env_config["stats_dir"]
+        statistics_oc.env_config["stats_dir"] = self.stats_dir
+        statistics_oc._catalogue.update({"mtime": None, "months": []})
+        statistics_oc._parse_month.cache_clear()
+        self.write("2024-01", JANUARY)
+        self.write("2024-02", FEBRUARY)
+
+    def tearDown(self):
+        statistics_oc.env_config["stats_dir"] = self.old_stats_dir
+        statistics_oc._catalogue.update({"mtime": None, "months": []})
+        statistics_oc._parse_month.cache_clear()
+        self.tmp.cleanup()
+
+    def write(self, month, content, mtime=None):
+        file_path = os.path.join(self.stats_dir, f"oc-{month}.prom")
+        with open(file_path, "w") as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(file_path, (mtime, mtime))
+        return file_path
+
+    def test_range_aggregation(self):
+        response = statistics_oc.app.request("/statistics/2024-01_2024-02")
+        self.assertEqual(response.status, "200 OK")
+        lines = response.data.decode("utf-8").splitlines()
+        self.assertIn("opencitations_requests_total 15", lines)
+        self.assertIn('opencitations_requests_by_country_total{country="Italy",country_iso="IT"} 9', lines)
+        self.assertIn('opencitations_requests_by_country_total{country="France",country_iso="FR"} 6', lines)
+        # Gauges keep the value of the last month
+        self.assertIn("opencitations_indexed_records 150", lines)
+        self.assertFalse([line for line in lines if "_created" in line])
+
+    def test_last_month(self):
+        response = statistics_oc.app.request("/statistics/last-month")
+        self.assertEqual(response.status, "200 OK")
+        self.assertIn("opencitations_requests_total 5", response.data.decode("utf-8").splitlines())
+
+    def test_catalogue_refresh(self):
+        self.assertEqual([month[:2] for month in statistics_oc.month_catalogue()], [(2024, 1), (2024, 2)])
+        self.write("2024-03", FEBRUARY)
+        # The directory mtime may not change within its resolution
+        os.utime(self.stats_dir, (time.time() + 10, time.time() + 10))
+        self.assertEqual([month[:2] for month in statistics_oc.month_catalogue()],
+                         [(2024, 1), (2024, 2), (2024, 3)])
+
+    def test_parse_month_cache(self):
+        file_path = self.write("2024-03", JANUARY, mtime=1000000)
+        self.assertIn(("opencitations_requests_total", {}, 10.0), statistics_oc.load_month_samples(file_path))
+        statistics_oc.load_month_samples(file_path)
+        self.assertEqual(statistics_oc._parse_month.cache_info().hits, 1)
+
+        self.write("2024-03", FEBRUARY, mtime=2000000)
+        self.assertIn(("opencitations_requests_total", {}, 5.0), statistics_oc.load_month_samples(file_path))
+        self.assertEqual(statistics_oc._parse_month.cache_info().misses, 2)
+
+    def test_warm_up(self):
+        statistics_oc.warm_up(months=1)
+        self.assertIsNotNone(statistics_oc._catalogue["mtime"])
+        self.assertIn("prometheus_client.parser", sys.modules)
+        self.assertEqual(statistics_oc._parse_month.cache_info().currsize, 1)
+
+        statistics_oc.load_month_samples(os.path.join(self.stats_dir, "oc-2024-02.prom"))
+        self.assertEqual(statistics_oc._parse_month.cache_info().hits, 1)
+
+    def test_warm_up_without_months(self):
+        statistics_oc.warm_up(months=0)
+        self.assertIsNotNone(statistics_oc._catalogue["mtime"])
+        self.assertEqual(statistics_oc._parse_month.cache_info().currsize, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+import glob
+import os
+import re
+import tempfile
+import threading
+import unittest
+
+import web
+
+from src import binlog
+from src.wl import RequestFilter, RequestSampler, WebLogger
+
+
+class RequestFilterTest(unittest.TestCase):
+    def test_exact(self):
+        f = RequestFilter({
+            "REMOTE_ADDR": ["127.0.0.1"],
+            "HTTP_USER_AGENT": ["Mozilla/5.0 (compatible)"],
+            "REQUEST_URI": ["/favicon.ico"]
+        })
+        self.assertTrue(f.match({"REMOTE_ADDR": "127.0.0.1"}))
+        self.assertFalse(f.match({"REMOTE_ADDR": "127.0.0.2"}))
+        self.assertTrue(f.match({"HTTP_USER_AGENT": "Mozilla/5.0 (compatible)"}))
+        self.assertFalse(f.match({"HTTP_USER_AGENT": "Mozilla/5.0"}))
+        self.assertTrue(f.match({"REQUEST_URI": "/favicon.ico"}))
+        self.assertFalse(f.match({"REQUEST_URI": "/favicon.ico?x"}))
+
+    def test_none_is_matched_as_string(self):
+        f = RequestFilter({"HTTP_REFERER": ["None"]})
+        self.assertTrue(f.match({}))
+
+    def test_cidr(self):
+        f = RequestFilter({
+            "REMOTE_ADDR": ["10.0.0.0/8", "2001:db8::/32"],
+            "HTTP_X_FORWARDED_FOR": ["cidr:192.168.1.1"]
+        })
+        self.assertTrue(f.match({"REMOTE_ADDR": "10.3.4.5"}))
+        self.assertFalse(f.match({"REMOTE_ADDR": "11.0.0.1"}))
+        self.assertTrue(f.match({"REMOTE_ADDR": "2001:db8::5"}))
+        self.assertFalse(f.match({"REMOTE_ADDR": "2001:db9::5"}))
+        self.assertFalse(f.match({"REMOTE_ADDR": "not an address"}))
+        self.assertTrue(f.match({"HTTP_X_FORWARDED_FOR": "8.8.8.8, 192.168.1.1"}))
+        self.assertFalse(f.match({"HTTP_X_FORWARDED_FOR": "8.8.8.8, 192.168.1.2"}))
+
+    def test_bad_cidr(self):
+        with self.assertRaises(ValueError):
+            RequestFilter({"REMOTE_ADDR": ["cidr:10.0.0.0/99"]})
+
+    def test_regex(self):
+        f = RequestFilter({"HTTP_USER_AGENT": ["re:kube-probe", re.compile("Health")]})
+        self.assertTrue(f.match({"HTTP_USER_AGENT": "kube-probe/1.27"}))
+        self.assertTrue(f.match({"HTTP_USER_AGENT": "ELB-HealthChecker/2.0"}))
+        self.assertFalse(f.match({"HTTP_USER_AGENT": "Mozilla/5.0"}))
+
+    def test_empty(self):
+        self.assertFalse(RequestFilter({}))
+
+
+class RequestSamplerTest(unittest.TestCase):
+    def test_rate(self):
+        s = RequestSampler({"/static/": 0.1})
+        kept = sum(s.keep({"REQUEST_URI": "/static/%d" % i}, ["REQUEST_URI"]) for i in range(10000))
+        self.assertTrue(800 < kept < 1200)
+        self.assertTrue(s.keep({"REQUEST_URI": "/statistics/last-month"}, ["REQUEST_URI"]))
+
+    def test_deterministic(self):
+        s = RequestSampler({"/static/": 0.5})
+        env = {"REQUEST_URI": "/static/css/oc.css", "REMOTE_ADDR": "1.2.3.4"}
+        self.assertEqual(
+            {s.keep(env, ["REQUEST_URI", "REMOTE_ADDR"]) for _ in range(10)},
+            {RequestSampler({"/static/": 0.5}).keep(env, ["REQUEST_URI", "REMOTE_ADDR"])})
+
+    def test_longest_prefix_wins(self):
+        s = RequestSampler({"/static/": 0.0, "/static/js/": 1.0})
+        self.assertTrue(s.keep({"REQUEST_URI": "/static/js/a.js"}, ["REQUEST_URI"]))
+        self.assertFalse(s.keep({"REQUEST_URI": "/static/css/a.css"}, ["REQUEST_URI"]))
+
+
+class WebLoggerFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.logger = WebLogger("test-filter-%s" % id(self), self.tmp.name, ["REMOTE_ADDR", "REQUEST_URI"],
+                                {"REMOTE_ADDR": ["127.0.0.1", "10.0.0.0/8"]}, {"/static/": 0.0})
+
+    def tearDown(self):
+        for handler in list(self.logger.l.handlers):
+            handler.close()
+            self.logger.l.removeHandler(handler)
+        self.tmp.cleanup()
+
+    def lines(self):
+        with open(os.path.join(self.tmp.name, "oc-%s.txt" % self.logger.month)) as f:
+            return f.readlines()
+
+    def mes(self, **env):
+        web.ctx.env = env
+        self.logger.mes()
+
+    def test_filtered_and_sampled_requests_are_not_written(self):
+        self.mes(REMOTE_ADDR="127.0.0.1", REQUEST_URI="/")
+        self.mes(REMOTE_ADDR="10.1.2.3", REQUEST_URI="/")
+        self.mes(REMOTE_ADDR="8.8.8.8", REQUEST_URI="/static/css/oc.css")
+        self.assertEqual(self.lines(), [])
+
+    def test_allowed_request_is_written(self):
+        self.mes(REMOTE_ADDR="8.8.8.8", REQUEST_URI="/statistics/last-month")
+        lines = self.lines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith("# REMOTE_ADDR: 8.8.8.8 # REQUEST_URI: /statistics/last-month \n"))
+
+
+class WebLoggerBinaryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.loggers = []
+
+    def tearDown(self):
+        for logger in self.loggers:
+            for handler in list(logger.l.handlers):
+                handler.close()
+                logger.l.removeHandler(handler)
+            if logger.binary_writer is not None:
+                logger.binary_writer.close()
+        self.tmp.cleanup()
+
+    def logger(self, log_format):
+        logger = WebLogger("test-binary-%s-%s" % (log_format, id(self)), self.tmp.name,
+                           ["REMOTE_ADDR", "REQUEST_URI"], {"REMOTE_ADDR": ["127.0.0.1"]}, log_format=log_format)
+        self.loggers.append(logger)
+        return logger
+
+    def segments(self, logger):
+        return binlog.month_segments(self.tmp.name, logger.month)
+
+    def test_bad_log_format(self):
+        with self.assertRaises(ValueError):
+            WebLogger("test-bad-format", self.tmp.name, ["REMOTE_ADDR"], log_format="json")
+
+    def test_binary(self):
+        logger = self.logger("binary")
+        for addr in ("8.8.8.8", "127.0.0.1", "9.9.9.9"):
+            web.ctx.env = {"REMOTE_ADDR": addr, "REQUEST_URI": "/"}
+            logger.mes()
+
+        segments = self.segments(logger)
+        self.assertEqual(len(segments), 1)
+        self.assertRegex(os.path.basename(segments[0]),
+                         r"^oc-%s\.%s-\d+-1\.bin$" % (logger.month, os.getpid()))
+        self.assertTrue(os.path.isfile(binlog.strings_path(segments[0])))
+        log = binlog.read_log(segments[0])
+        self.assertEqual([values for _, values in log.records()], [
+            {"REMOTE_ADDR": "8.8.8.8", "REQUEST_URI": "/"},
+            {"REMOTE_ADDR": "9.9.9.9", "REQUEST_URI": "/"}
+        ])
+        self.assertFalse(glob.glob(os.path.join(self.tmp.name, "*.txt")))
+
+    def test_both(self):
+        logger = self.logger("both")
+        web.ctx.env = {"REMOTE_ADDR": "8.8.8.8", "REQUEST_URI": "/"}
+        logger.mes()
+        self.assertEqual(len(binlog.read_log(self.segments(logger)[0])), 1)
+        with open(os.path.join(self.tmp.name, "oc-%s.txt" % logger.month)) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+    def test_rotation_when_full(self):
+        logger = self.logger("binary")
+        web.ctx.env = {"REMOTE_ADDR": "8.8.8.8", "REQUEST_URI": "/"}
+        logger.mes()
+        logger.binary_writer.max_strings_size = 1
+        web.ctx.env = {"REMOTE_ADDR": "9.9.9.9", "REQUEST_URI": "/"}
+        logger.mes()
+        logger.mes()
+
+        segments = self.segments(logger)
+        self.assertEqual([os.path.basename(path).rsplit("-", 1)[1] for path in segments], ["1.bin", "2.bin"])
+        self.assertEqual([len(binlog.read_log(path)) for path in segments], [1, 2])
+
+    def test_threads(self):
+        logger = self.logger("binary")
+
+        def log(thread):
+            for idx in range(500):
+                web.ctx.env = {"REMOTE_ADDR": "%s-%s" % (thread, idx), "REQUEST_URI": "/%s-%s" % (thread, idx)}
+                logger.mes()
+                if idx % 100 == 0:
+                    # Force frequent rotations
+                    logger.binary_writer.max_strings_size = 1
+
+        threads = [threading.Thread(target=log, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.binary_writer.close()
+
+        segments = self.segments(logger)
+        self.assertGreater(len(segments), 1)
+        count = 0
+        for path in segments:
+            for _, values in binlog.read_log(path).records():
+                self.assertEqual("/" + values["REMOTE_ADDR"], values["REQUEST_URI"])
+                count += 1
+        self.assertEqual(count, 8 * 500)
+
+
+if __name__ == "__main__":
+    unittest.main()